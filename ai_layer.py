@@ -1,7 +1,58 @@
+import asyncio
+import hashlib
 import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from operator import itemgetter
+import numpy as np
 import google.generativeai as genai
 from stats_engine import StatsEngine
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, Iterator
+
+# 各分析提示共用的角色設定與統計數據摘要，以 format_map 填入數值
+STATS_CONTEXT_TEMPLATE = """
+您是一位專業的樂透數據分析師，專精於「今彩539」。請根據以下最近 {num_draws} 期的統計數據，提供您的專業分析與見解。請用繁體中文回答。
+
+--- 數據摘要 (最近 {num_draws} 期，資料截至 {latest_date}) ---
+- **熱門號碼 (出現最多次)**: {hot_numbers}
+- **冷門號碼 (出現最少次)**: {cold_numbers}
+- **和值趨勢**: 平均和值為 {mean_sum:.2f}，近期和值在 {min_sum} 到 {max_sum} 之間波動。
+- **奇偶比趨勢**: 最常見的奇偶比為「{common_odd_even}」。
+- **大小比趨勢** (1-19為小, 20-39為大): 最常見的大小比為「{common_big_small}」。
+- **連號趨勢**: 最近 {num_draws} 期中，有 {total_draws_with_consecutive} 期出現連號，佔比約 {percentage_with_consecutive:.2f}%。
+- **尾數趨勢**: 最熱門的尾數為 {hot_last_digits}。
+"""
+
+SUMMARY_TASK_PROMPT = """
+--- 分析任務 ---
+**總結趨勢**: 請用 2-3 句話，以專業且易懂的方式，總結近期的主要趨勢。
+"""
+
+PICKS_TASK_PROMPT = """
+--- 分析任務 ---
+請依序完成以下兩項任務，並分別以「#### 2. 選號建議」與「#### 3. 選號理由」作為標題：
+
+1.  **提供建議**: 基於「排除低機率極端組合」的原則（例如，避免全奇/全偶、全大/全小、和值過高/過低），並結合上述數據，請提供 2 組 (每組 5 個號碼) 具有參考價值的選號建議。
+2.  **說明理由**: 簡要說明您提供這 2 組號碼的理由，例如您是如何平衡熱門/冷門號碼，或如何考慮奇偶/大小比的。
+"""
+
+# google-generativeai 在整個程序中共用同一個非同步 gRPC 客戶端，而該客戶端只能在建立它的事件迴圈上使用。
+# 因此所有 AILayer 實例 (每個 Streamlit 工作階段各一個) 都把協程交給同一個背景執行緒上的事件迴圈執行。
+_loop = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """
+    取得 (必要時啟動) 程序共用、於背景執行緒持續運行的事件迴圈。
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='ai-layer-loop', daemon=True).start()
+    return _loop
 
 class AILayer:
     """
@@ -9,11 +60,61 @@ class AILayer:
     負責將統計數據注入 Gemini 模型並獲取分析結果。
     """
 
-    def __init__(self, stats_engine: StatsEngine):
+    def __init__(self, stats_engine: StatsEngine, cache_path: str = 'lottery_data/ai_cache.sqlite'):
         self.stats_engine = stats_engine
+        self.cache_path = cache_path
         self.model = None
         self.chat = None
 
+    def _run(self, coro):
+        """
+        在程序共用的背景事件迴圈上執行協程並等待結果，供同步呼叫端 (Streamlit、命令列) 使用。
+        """
+        return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+    def _cache_connect(self) -> sqlite3.Connection:
+        """
+        開啟 AI 回應快取資料庫，必要時建立資料表。
+        """
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.cache_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS ai_cache (prompt_hash TEXT PRIMARY KEY, response TEXT, ts INT)")
+        return conn
+
+    def _cache_get(self, key: str) -> str:
+        """
+        依提示雜湊值讀取快取的 AI 回應，未命中時返回 None。
+        """
+        try:
+            with closing(self._cache_connect()) as conn:
+                row = conn.execute("SELECT response FROM ai_cache WHERE prompt_hash = ?", (key,)).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"讀取 AI 快取失敗: {e}")
+            return None
+
+    def _cache_put(self, key: str, val: str):
+        """
+        將 AI 回應寫入快取。
+        """
+        try:
+            with closing(self._cache_connect()) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO ai_cache (prompt_hash, response, ts) VALUES (?, ?, ?)", (key, val, int(time.time())))
+        except sqlite3.Error as e:
+            print(f"寫入 AI 快取失敗: {e}")
+
+    async def _generate_cached(self, prompt: str) -> str:
+        """
+        以提示內容的 SHA-1 作為鍵值，命中快取時直接返回，否則呼叫 Gemini 並寫入快取。
+        """
+        key = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        response = await self.model.generate_content_async(prompt)
+        self._cache_put(key, response.text)
+        return response.text
+
     def configure_api_key(self, api_key: str = None):
         """
         配置 Google Gemini API 金鑰。
@@ -31,93 +132,144 @@ class AILayer:
             print(f"❌ 配置 Gemini API 金鑰時發生錯誤: {e}")
             self.model = None
 
-    def _generate_analysis_prompt(self, num_draws: int = 30) -> str:
+    def _generate_stats_context(self, num_draws: int = 30) -> str:
         """
-        生成用於 AI 分析的詳細提示 (Prompt)。
+        生成各分析提示共用的角色設定與統計數據摘要。
         """
-        if self.stats_engine.df.empty:
+        if len(self.stats_engine.nums) == 0:
             return "錯誤：無法生成提示，因為沒有可用的統計數據。"
 
-        # 獲取統計數據
-        freq = self.stats_engine.calculate_frequency(num_draws=num_draws)
-        sum_analysis = self.stats_engine.calculate_sum_analysis(num_draws=num_draws)
-        ratios = self.stats_engine.calculate_odd_even_big_small_ratios(num_draws=num_draws)
-        consecutive = self.stats_engine.analyze_consecutive_numbers(num_draws=num_draws)
-        last_digits = self.stats_engine.analyze_last_digits(num_draws=num_draws)
-
-        # 排序頻率以找到熱門和冷門號碼
-        sorted_freq = sorted(freq.items(), key=lambda item: item[1])
-        hot_numbers = [f"{item[0]:02d}" for item in sorted_freq[-5:]] # Top 5
-        cold_numbers = [f"{item[0]:02d}" for item in sorted_freq[:5]] # Bottom 5
-
-        # 找到最常見的奇偶比和大小比
-        common_odd_even = max(ratios['odd_even_distribution'], key=ratios['odd_even_distribution'].get)
-        common_big_small = max(ratios['big_small_distribution'], key=ratios['big_small_distribution'].get)
-        
-        # 找到最熱門的尾數
-        hot_last_digits = sorted(last_digits.items(), key=lambda item: item[1], reverse=True)
-        hot_last_digits_str = ", ".join([str(item[0]) for item in hot_last_digits[:3]])
+        # 獲取統計數據 (單次計算所有項目)
+        stats = self.stats_engine.calculate_all_stats(num_draws=num_draws)
+        freq = stats.frequency
+        sum_analysis = stats.sum_analysis
+        ratios = stats.ratios
+        consecutive = stats.consecutive
+        last_digits = stats.last_digits
 
+        # 最新開獎日期寫入提示中，資料更新後快取鍵值隨之改變
+        latest_date = str(self.stats_engine.dates[-1])
 
-        prompt = f"""
-您是一位專業的樂透數據分析師，專精於「今彩539」。請根據以下最近 {num_draws} 期的統計數據，提供您的專業分析與見解。請用繁體中文回答。
+        # 依頻率排序號碼 (穩定排序，同頻率時號碼小者在前) 以找到熱門和冷門號碼
+        numbers_by_freq = np.argsort(np.fromiter(freq.values(), dtype=np.int64), kind='stable') + 1
 
---- 數據摘要 (最近 {num_draws} 期) ---
-- **熱門號碼 (出現最多次)**: {', '.join(hot_numbers)}
-- **冷門號碼 (出現最少次)**: {', '.join(cold_numbers)}
-- **和值趨勢**: 平均和值為 {sum_analysis['mean_sum']:.2f}，近期和值在 {sum_analysis['min_sum']} 到 {sum_analysis['max_sum']} 之間波動。
-- **奇偶比趨勢**: 最常見的奇偶比為「{common_odd_even}」。
-- **大小比趨勢** (1-19為小, 20-39為大): 最常見的大小比為「{common_big_small}」。
-- **連號趨勢**: 最近 {num_draws} 期中，有 {consecutive['total_draws_with_consecutive']} 期出現連號，佔比約 {consecutive['percentage_with_consecutive']:.2f}%。
-- **尾數趨勢**: 最熱門的尾數為 {hot_last_digits_str}。
+        # 找到最熱門的尾數
+        hot_last_digits = sorted(last_digits.items(), key=itemgetter(1), reverse=True)
 
---- 分析任務 ---
-請根據以上數據，完成以下三項任務：
+        return STATS_CONTEXT_TEMPLATE.format_map({
+            'num_draws': num_draws,
+            'latest_date': latest_date,
+            'hot_numbers': ', '.join(f"{num:02d}" for num in numbers_by_freq[-5:].tolist()), # Top 5
+            'cold_numbers': ', '.join(f"{num:02d}" for num in numbers_by_freq[:5].tolist()), # Bottom 5
+            'mean_sum': sum_analysis['mean_sum'],
+            'min_sum': sum_analysis['min_sum'],
+            'max_sum': sum_analysis['max_sum'],
+            # 找到最常見的奇偶比和大小比
+            'common_odd_even': max(ratios['odd_even_distribution'].items(), key=itemgetter(1))[0],
+            'common_big_small': max(ratios['big_small_distribution'].items(), key=itemgetter(1))[0],
+            'total_draws_with_consecutive': consecutive['total_draws_with_consecutive'],
+            'percentage_with_consecutive': consecutive['percentage_with_consecutive'],
+            'hot_last_digits': ', '.join(str(digit) for digit, _ in hot_last_digits[:3])
+        })
 
-1.  **總結趨勢**: 請用 2-3 句話，以專業且易懂的方式，總結近期的主要趨勢。
-2.  **提供建議**: 基於「排除低機率極端組合」的原則（例如，避免全奇/全偶、全大/全小、和值過高/過低），並結合上述數據，請提供 2 組 (每組 5 個號碼) 具有參考價值的選號建議。
-3.  **說明理由**: 簡要說明您提供這 2 組號碼的理由，例如您是如何平衡熱門/冷門號碼，或如何考慮奇偶/大小比的。
-"""
-        return prompt
+    def _prompt_summary(self, stats_context: str) -> str:
+        """
+        生成「總結趨勢」子任務的提示。
+        """
+        return stats_context + SUMMARY_TASK_PROMPT
 
-    def get_ai_analysis(self, num_draws: int = 30) -> str:
+    def _prompt_picks(self, stats_context: str) -> str:
+        """
+        生成「提供建議」與「說明理由」子任務的提示。
+        理由依賴選號結果，因此合併在同一個請求中處理。
+        """
+        return stats_context + PICKS_TASK_PROMPT
+
+    async def aget_ai_analysis(self, num_draws: int = 30) -> str:
         """
-        獲取 AI 對統計數據的分析，並啟動一個新的對話會話。
+        非同步獲取 AI 對統計數據的分析，並啟動一個新的對話會話。
+        趨勢總結與選號建議 (含理由) 兩個請求同時發送。
         返回初始的 AI 分析文本。
         """
         if not self.model:
             return "錯誤：Gemini 模型未配置。請先設定 API 金鑰。"
 
-        analysis_prompt = self._generate_analysis_prompt(num_draws)
-        if analysis_prompt.startswith("錯誤"):
-            return analysis_prompt
+        stats_context = self._generate_stats_context(num_draws)
+        if stats_context.startswith("錯誤"):
+            return stats_context
             
         try:
             print("正在向 Gemini API 發送請求，啟動對話會話，請稍候...")
-            # Start a new chat session with the analysis prompt directly
-            self.chat = self.model.start_chat(history=[])
-            response = self.chat.send_message(analysis_prompt)
-            return response.text
+            summary, picks = await asyncio.gather(
+                self._generate_cached(self._prompt_summary(stats_context)),
+                self._generate_cached(self._prompt_picks(stats_context))
+            )
+
+            analysis = f"#### 1. 趨勢總結\n{summary}\n\n{picks}"
+
+            # Seed the chat session with the stats and the combined analysis for follow-up questions
+            self.chat = self.model.start_chat(history=[
+                {'role': 'user', 'parts': [stats_context]},
+                {'role': 'model', 'parts': [analysis]}
+            ])
+            return analysis
         except Exception as e:
             return f"❌ 與 Gemini API 互動時發生錯誤: {e}"
 
-    def send_chat_message(self, message: str) -> str:
+    def get_ai_analysis(self, num_draws: int = 30) -> str:
+        """
+        aget_ai_analysis 的同步版本。
         """
-        向活躍的對話會話發送訊息並獲取 AI 的回應。
+        return self._run(self.aget_ai_analysis(num_draws))
+
+    async def asend_chat_message(self, message: str) -> str:
+        """
+        非同步向活躍的對話會話發送訊息並獲取 AI 的回應。
         """
         if not self.chat:
             return "錯誤：對話會話未啟動。請先獲取 AI 分析以啟動對話。"
         try:
-            response = self.chat.send_message(message)
+            response = await self.chat.send_message_async(message)
             return response.text
         except Exception as e:
             return f"❌ 與 Gemini API 對話時發生錯誤: {e}"
 
+    def send_chat_message(self, message: str) -> str:
+        """
+        asend_chat_message 的同步版本。
+        """
+        return self._run(self.asend_chat_message(message))
+
+    async def astream_chat_message(self, message: str) -> AsyncIterator[str]:
+        """
+        非同步向活躍的對話會話發送訊息，並逐段產出 AI 的回應文字。
+        """
+        if not self.chat:
+            yield "錯誤：對話會話未啟動。請先獲取 AI 分析以啟動對話。"
+            return
+        try:
+            response = await self.chat.send_message_async(message, stream=True)
+            async for chunk in response:
+                yield chunk.text
+        except Exception as e:
+            yield f"❌ 與 Gemini API 對話時發生錯誤: {e}"
+
+    def stream_chat_message(self, message: str) -> Iterator[str]:
+        """
+        astream_chat_message 的同步版本，可直接交給 st.write_stream。
+        """
+        stream = self.astream_chat_message(message)
+        while True:
+            try:
+                yield self._run(stream.__anext__())
+            except StopAsyncIteration:
+                return
+
 # 範例使用
 if __name__ == "__main__":
-    # 確保 lottery_data/lottery_data.csv 存在
-    if not os.path.exists('lottery_data/lottery_data.csv'):
-        print("錯誤：找不到 lottery_data/lottery_data.csv。")
+    # 確保 lottery_data/lottery_data.parquet 存在
+    if not os.path.exists('lottery_data/lottery_data.parquet'):
+        print("錯誤：找不到 lottery_data/lottery_data.parquet。")
         print("請先執行 python data_engine.py 來生成數據。")
     else:
         # 1. 創建統計引擎實例
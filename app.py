@@ -1,20 +1,11 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
 from data_engine import DailyCashCrawler
 from stats_engine import StatsEngine
 from ai_layer import AILayer
 import time
 from typing import Dict
-import sys
-
-# Set matplotlib font to support Chinese characters conditionally
-if sys.platform == "win32":
-    plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']  # For Windows
-else:
-    plt.rcParams['font.sans-serif'] = ['Noto Sans CJK TC', 'Noto Sans CJK JP', 'Noto Sans CJK SC', 'Noto Sans CJK KR', 'Noto Sans CJK', 'WenQuanYi Zen Hei', 'DejaVu Sans', 'sans-serif'] # For Linux/macOS (Streamlit Cloud)
-plt.rcParams['axes.unicode_minus'] = False # To handle negative signs correctly
 
 # --- Streamlit App Configuration ---
 st.set_page_config(
@@ -23,59 +14,45 @@ st.set_page_config(
     layout="wide"
 )
 
+DATA_FILEPATH = 'lottery_data/lottery_data.parquet'
+
 # --- Helper Functions ---
-@st.cache_data
-def load_and_process_data():
-    """Load data from CSV and perform initial processing."""
-    crawler = DailyCashCrawler()
-    # Ensure data is up-to-date before loading
-    crawler.crawl_and_save_daily_cash() 
-    
-    # Load the updated data
-    if os.path.exists('lottery_data/lottery_data.csv'):
-        df = pd.read_csv('lottery_data/lottery_data.csv', dtype={'draw': str})
-        df['numbers_list'] = df['numbers'].apply(lambda x: [int(n) for n in x.split(',')])
-        df['ad_date'] = pd.to_datetime(df['ad_date'])
-        df = df.sort_values(by='ad_date', ascending=True).reset_index(drop=True)
-        return df
+def get_data_mtime() -> float:
+    """Return the data file's mtime, or None when it does not exist yet."""
+    return os.path.getmtime(DATA_FILEPATH) if os.path.exists(DATA_FILEPATH) else None
+
+# Both caches are keyed on the data file's mtime, so a file rewritten outside the app
+# (e.g. `python data_engine.py`) is re-read on the next rerun; only the current version is kept.
+@st.cache_data(max_entries=1)
+def load_and_process_data(mtime: float):
+    """Load data from Parquet for the given file version."""
+    if mtime is not None and os.path.exists(DATA_FILEPATH):
+        # StatsEngine orders the draws by date itself, so no sort is needed here
+        return pd.read_parquet(DATA_FILEPATH, engine='pyarrow', dtype_backend='pyarrow')
     return pd.DataFrame()
 
+@st.cache_resource(max_entries=1)
+def get_stats_engine(mtime: float, _df: pd.DataFrame) -> StatsEngine:
+    """Build one StatsEngine per data file version, reusing the DataFrame loaded for the same mtime."""
+    return StatsEngine(df=_df)
+
 def display_frequency_chart(data: Dict[int, int], title: str):
-    """Display a bar chart for number frequency."""
+    """Display a bar chart for number frequency (keys already ascending, as returned by StatsEngine)."""
     if not data:
         st.warning("沒有頻率數據可供顯示。")
         return
 
-    numbers = list(data.keys())
-    counts = list(data.values())
-
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.bar(numbers, counts, color='skyblue')
-    ax.set_xlabel("號碼")
-    ax.set_ylabel("出現次數")
-    ax.set_title(title)
-    ax.set_xticks(numbers)
-    ax.grid(axis='y', linestyle='--', alpha=0.7)
-    st.pyplot(fig)
-    plt.close(fig)
+    st.caption(title)
+    st.bar_chart(pd.Series(data, name="出現次數").rename_axis("號碼"), color="#87CEEB")
 
 def display_distribution_chart(data: Dict[str, int], title: str):
-    """Display a bar chart for distribution (e.g., odd/even, big/small)."""
+    """Display a bar chart for distribution (e.g., odd/even, big/small); keys already ascending, as returned by StatsEngine."""
     if not data:
         st.warning("沒有分佈數據可供顯示。")
         return
 
-    labels = list(data.keys())
-    counts = list(data.values())
-
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.bar(labels, counts, color='lightcoral')
-    ax.set_xlabel("模式")
-    ax.set_ylabel("出現次數")
-    ax.set_title(title)
-    ax.grid(axis='y', linestyle='--', alpha=0.7)
-    st.pyplot(fig)
-    plt.close(fig)
+    st.caption(title)
+    st.bar_chart(pd.Series(data, name="出現次數").rename_axis("模式"), color="#F08080")
 
 # --- Main Application ---
 st.title("🎲 今彩539 智慧統計與 AI 預測助手")
@@ -85,21 +62,30 @@ st.sidebar.header("設定")
 api_key = st.sidebar.text_input("輸入您的 Google API Key", type="password", key="gemini_api_key")
 
 # Data Update Button
-if st.sidebar.button("更新今彩539資料"):
+update_clicked = st.sidebar.button("更新今彩539資料")
+if update_clicked:
     with st.spinner("正在更新資料，請稍候..."):
-        df_data = load_and_process_data()
-        if not df_data.empty:
-            st.sidebar.success(f"資料更新完成！總計 {len(df_data)} 筆記錄。")
-        else:
-            st.sidebar.error("資料更新失敗。")
-
-# Load data (and update if necessary)
-df_data = load_and_process_data()
+        DailyCashCrawler().crawl_and_save_daily_cash()
+elif not os.path.exists(DATA_FILEPATH) and "initial_crawl_done" not in st.session_state:
+    # First run without local data: crawl once, later updates only happen via the sidebar button
+    with st.spinner("首次執行，正在下載今彩539歷史資料..."):
+        DailyCashCrawler().crawl_and_save_daily_cash()
+    st.session_state.initial_crawl_done = True
+
+# Load data for the current file version; a new mtime invalidates both the data and the engine
+data_mtime = get_data_mtime()
+df_data = load_and_process_data(data_mtime)
+
+if update_clicked:
+    if not df_data.empty:
+        st.sidebar.success(f"資料更新完成！總計 {len(df_data)} 筆記錄。")
+    else:
+        st.sidebar.error("資料更新失敗。")
 
 if df_data.empty:
     st.error("無法載入今彩539歷史資料。請檢查網路連線或稍後再試。")
 else:
-    stats_engine = StatsEngine(data_filepath='lottery_data/lottery_data.csv') # Re-initialize to ensure latest data
+    stats_engine = get_stats_engine(data_mtime, df_data)
     
     st.subheader("📊 資料概覽")
     col1, col2, col3 = st.columns(3)
@@ -119,13 +105,11 @@ else:
     st.write("#### 最近五期開獎號碼")
     latest_5_draws_df = stats_engine.get_latest_n_draws(5)
     if not latest_5_draws_df.empty:
-        # Sort by date in descending order (most recent first)
-        latest_5_draws_df = latest_5_draws_df.sort_values(by='ad_date', ascending=False).reset_index(drop=True)
-        
-        for index, row in latest_5_draws_df.iterrows():
-            draw_num = row['draw']
-            draw_date = row['date']
-            numbers = row['numbers'] # This is already formatted as "01,02,..."
+        # Draws are already sorted by date ascending, so reversing gives most recent first
+        for row in latest_5_draws_df[['draw', 'date', 'numbers']].iloc[::-1].itertuples(index=False):
+            draw_num = row.draw
+            draw_date = row.date
+            numbers = row.numbers # This is already formatted as "01,02,..."
             
             st.markdown(f"**期數**: {draw_num} &nbsp; **日期**: {draw_date} &nbsp; **號碼**: <big><span style='font-weight:bold; color:#FF4B4B;'>{numbers}</span></big>", unsafe_allow_html=True)
         st.markdown("---")
@@ -186,6 +170,8 @@ else:
 
     if "ai_layer" not in st.session_state:
         st.session_state.ai_layer = AILayer(stats_engine)
+    # Point the AI layer at the current engine so a data update reaches the prompts
+    st.session_state.ai_layer.stats_engine = stats_engine
     
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -215,10 +201,9 @@ else:
                         st.markdown(prompt)
 
                     with st.chat_message("assistant"):
-                        with st.spinner("AI 思考中..."):
-                            response = st.session_state.ai_layer.send_chat_message(prompt)
-                            st.markdown(response)
-                            st.session_state.messages.append({"role": "assistant", "content": response})
+                        # Render tokens as they arrive; write_stream returns the full text once done
+                        response = st.write_stream(st.session_state.ai_layer.stream_chat_message(prompt))
+                        st.session_state.messages.append({"role": "assistant", "content": response})
 
             else:
                 st.error("AI 模型配置失敗，請檢查您的 API Key。")
@@ -1,30 +1,42 @@
-import requests
-import json
+import asyncio
+import httpx
+import orjson
 import os
-import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Any
+import numpy as np
 import pandas as pd
-import urllib3
+import polars as pl
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 
-# Disable SSL warnings globally as per the original script's approach
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+TAIPEI = timezone(timedelta(hours=8))
+DRAW_HOUR = 21 # 今彩539 約於台灣時間每晚 21:00 後開獎
 
 class DailyCashCrawler:
     """今彩539資料爬蟲類別"""
     
-    def __init__(self):
+    def __init__(self, max_concurrency: int = 8):
         self.base_url = "https://api.taiwanlottery.com/TLCAPIWeB/Lottery"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Accept': 'application/json',
             'Accept-Language': 'zh-TW,zh;q=0.9,en;q=0.8'
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
-        self.session.verify = False # Ignore SSL certificate verification
+        self.max_concurrency = max_concurrency # 同時進行的月份請求上限，避免對 API 造成負擔
+        self._semaphore = None
     
-    def crawl_daily_cash(self, year_month: str, page_num: int = 1, page_size: int = 50) -> Dict[str, Any]:
+    def _create_client(self) -> httpx.AsyncClient:
+        """建立單一共用的 HTTP/2 連線客戶端，讓所有月份請求共用同一條 TLS 連線"""
+        return httpx.AsyncClient(
+            headers=self.headers,
+            verify=False, # Ignore SSL certificate verification
+            http2=True,
+            timeout=10,
+            limits=httpx.Limits(max_keepalive_connections=16)
+        )
+    
+    async def crawl_daily_cash(self, client: httpx.AsyncClient, year_month: str, page_num: int = 1, page_size: int = 50) -> Dict[str, Any]:
         """爬取今彩539資料"""
         url = f"{self.base_url}/Daily539Result"
         params = {
@@ -35,63 +47,95 @@ class DailyCashCrawler:
         
         try:
             print(f"正在爬取今彩539資料: {year_month}, 頁數: {page_num}")
-            response = self.session.get(url, params=params, timeout=10)
+            response = await client.get(url, params=params, timeout=10)
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             if data.get('rtCode') == 0:
                 return data.get('content', {})
             else:
                 print(f"API 錯誤: {data.get('rtMsg', '未知錯誤')}")
                 return {}
                 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             print(f"請求今彩539資料失敗: {e}")
             return {}
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             print(f"解析今彩539 JSON 失敗: {e}")
             return {}
     
-    def process_daily_cash_data(self, raw_data: List[Dict]) -> List[Dict]:
-        """處理今彩539資料格式，返回列表以便於轉換為DataFrame"""
-        processed_list = []
+    async def _fetch_month(self, client: httpx.AsyncClient, year_month: str) -> Dict[str, Any]:
+        """在併發上限內爬取單一月份的資料"""
+        async with self._semaphore:
+            raw_content = await self.crawl_daily_cash(client, year_month)
+            await asyncio.sleep(1) # Avoid frequent requests
+            return raw_content
+    
+    def process_daily_cash_data(self, raw_data: List[Dict]) -> pd.DataFrame:
+        """處理今彩539資料格式，以向量化運算轉換為DataFrame"""
+        lottery_dates, periods, draw_numbers = [], [], []
         
         for item in raw_data:
             try:
-                lottery_date_str = item['lotteryDate'].replace('T00:00:00', '')
-                lottery_date = datetime.fromisoformat(lottery_date_str)
-                tw_year = lottery_date.year - 1911
-                
-                period = str(item['period'])
-                
-                draw_numbers = item['drawNumberAppear']
-                numbers = sorted(draw_numbers[:5])
-                
-                processed_list.append({
-                    'draw': period,
-                    'date': f"{tw_year}/{lottery_date.month:02d}/{lottery_date.day:02d}",
-                    'ad_date': lottery_date.strftime('%Y-%m-%d'), # For sorting and internal use
-                    'numbers': ','.join(f"{n:02d}" for n in numbers), # Format as "01,02,03,04,05"
-                    'price': 8000000,
-                    'lottery_type': 'daily_cash'
-                })
-                
-            except (KeyError, ValueError, IndexError) as e:
+                lottery_date, period, numbers = item['lotteryDate'], str(item['period']), item['drawNumberAppear'][:5]
+                if len(numbers) != 5:
+                    raise ValueError(f"開獎號碼數量不足: {numbers}")
+            except (KeyError, ValueError, TypeError) as e:
                 print(f"處理今彩539資料錯誤: {e}, 項目: {item}")
                 continue
+            
+            lottery_dates.append(lottery_date)
+            periods.append(period)
+            draw_numbers.append(numbers)
         
-        return processed_list
+        if not periods:
+            return pd.DataFrame()
+        
+        dates = pd.to_datetime(pd.Series(lottery_dates), format='ISO8601', errors='coerce')
+        valid = dates.notna().to_numpy()
+        if not valid.all():
+            print(f"處理今彩539資料錯誤: 無法解析日期 {[d for d, ok in zip(lottery_dates, valid) if not ok]}")
+        dates = dates[valid].reset_index(drop=True)
+        
+        # Sort each draw's numbers and zero-pad them column by column, then join as "01,02,03,04,05"
+        padded = np.char.zfill(np.sort(np.asarray(draw_numbers, dtype=np.int64)[valid], axis=1).astype(str), 2)
+        numbers = pd.Series(padded[:, 0]).str.cat([pd.Series(padded[:, j]) for j in range(1, 5)], sep=',')
+        
+        return pd.DataFrame({
+            'draw': np.asarray(periods, dtype=object)[valid],
+            'date': (dates.dt.year - 1911).astype(str) + dates.dt.strftime('/%m/%d'),
+            'ad_date': dates.dt.strftime('%Y-%m-%d'), # For sorting and internal use
+            'numbers': numbers,
+            'price': 8000000,
+            'lottery_type': 'daily_cash'
+        })
+    
+    def migrate_csv_to_parquet(self, csv_path: str, parquet_path: str) -> bool:
+        """將舊版CSV資料一次性轉換為Parquet格式"""
+        if os.path.exists(parquet_path) or not os.path.exists(csv_path):
+            return False
+        try:
+            # Arrow's multi-threaded reader; column types are fixed at parse time so 'draw' keeps leading zeros
+            # (pandas' dtype= would only be applied after Arrow had already inferred int64)
+            table = pa_csv.read_csv(csv_path, convert_options=pa_csv.ConvertOptions(column_types={
+                'draw': pa.string(), 'date': pa.string(), 'ad_date': pa.timestamp('ns'), 'numbers': pa.string()
+            }))
+            df = table.to_pandas(types_mapper=pd.ArrowDtype)
+            df['lottery_type'] = df['lottery_type'].astype('category')
+            df.to_parquet(parquet_path, compression='snappy', index=False)
+            print(f"🔄 已將 {csv_path} 轉換為 {parquet_path}")
+            return True
+        except Exception as e:
+            print(f"轉換CSV資料為Parquet失敗: {e}")
+            return False
     
     def get_existing_data_df(self, filepath: str) -> pd.DataFrame:
-        """讀取現有CSV資料為DataFrame"""
+        """讀取現有Parquet資料為DataFrame"""
         if os.path.exists(filepath):
             try:
-                df = pd.read_csv(filepath, dtype={'draw': str}) # Ensure 'draw' is read as string
-                # Convert 'ad_date' back to datetime for proper comparison
-                df['ad_date'] = pd.to_datetime(df['ad_date'])
-                return df
+                return pd.read_parquet(filepath, engine='pyarrow', dtype_backend='pyarrow')
             except Exception as e:
-                print(f"讀取現有CSV資料失敗: {e}")
+                print(f"讀取現有Parquet資料失敗: {e}")
                 return pd.DataFrame()
         return pd.DataFrame()
     
@@ -102,16 +146,27 @@ class DailyCashCrawler:
         return None
     
     def crawl_and_save_daily_cash(self, start_year: int = 2014, start_month: int = 1):
-        """智能爬取今彩539資料並儲存到CSV"""
+        """智能爬取今彩539資料並儲存到Parquet"""
+        asyncio.run(self._crawl_async(start_year, start_month))
+    
+    async def _crawl_async(self, start_year: int, start_month: int):
+        """併發爬取各月份資料，合併後儲存到Parquet"""
         output_dir = 'lottery_data'
         os.makedirs(output_dir, exist_ok=True)
-        filepath = os.path.join(output_dir, 'lottery_data.csv')
+        filepath = os.path.join(output_dir, 'lottery_data.parquet')
+        self.migrate_csv_to_parquet(os.path.join(output_dir, 'lottery_data.csv'), filepath)
         
         existing_df = self.get_existing_data_df(filepath)
         latest_date_ad = self.get_latest_ad_date(existing_df)
         
         current_date = datetime.now()
         
+        # 今日 21:00 前最多只會有昨日的開獎結果
+        expected_latest = (datetime.now(tz=TAIPEI) - timedelta(hours=DRAW_HOUR)).date()
+        if latest_date_ad and latest_date_ad.date() >= expected_latest:
+            print(f"\n🎉 今彩539資料已是最新 (最新日期: {latest_date_ad.strftime('%Y-%m-%d')})，略過爬取。總計 {len(existing_df)} 筆記錄")
+            return
+        
         if latest_date_ad:
             # 從最新資料的月份開始爬取（確保不遺漏）
             start_crawl_date = latest_date_ad.replace(day=1)
@@ -121,53 +176,64 @@ class DailyCashCrawler:
             start_crawl_date = datetime(start_year, start_month, 1)
             print(f"🆕 首次爬取今彩539資料，從 {start_year}-{start_month:02d} 開始")
         
-        all_new_records = []
-        new_count = 0
+        # 預先計算所有需要爬取的月份 (以 year*12 + month-1 的整數索引表示)
+        start_idx = start_crawl_date.year * 12 + start_crawl_date.month - 1
+        end_idx = current_date.year * 12 + current_date.month - 1
+        months = [f"{idx // 12}-{idx % 12 + 1:02d}" for idx in range(start_idx, end_idx + 1)]
         
-        current_month_iter = start_crawl_date
-        while current_month_iter <= current_date:
-            year_month = f"{current_month_iter.year}-{current_month_iter.month:02d}"
-            
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._create_client() as client:
+            tasks = [self._fetch_month(client, year_month) for year_month in months]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        new_frames = []
+        latest_ad_str = latest_date_ad.strftime('%Y-%m-%d') if latest_date_ad else None
+        
+        for year_month, raw_content in zip(months, results):
             try:
-                raw_content = self.crawl_daily_cash(year_month)
+                if isinstance(raw_content, Exception):
+                    raise raw_content
+                
                 if raw_content and 'daily539Res' in raw_content:
-                    processed_list = self.process_daily_cash_data(raw_content['daily539Res'])
+                    processed_df = self.process_daily_cash_data(raw_content['daily539Res'])
                     
-                    for record in processed_list:
-                        # Only add if it's newer than the latest existing record
-                        # Or if there's no existing data
-                        if latest_date_ad is None or datetime.fromisoformat(record['ad_date']) > latest_date_ad:
-                            all_new_records.append(record)
-                            new_count += 1
+                    if processed_df.empty:
+                        continue
                     
-                    if processed_list: # Only print if there was data for the month
-                        print(f"✅ {year_month}: 處理了 {len(processed_list)} 筆資料")
-                
-                time.sleep(1) # Avoid frequent requests
+                    if latest_ad_str is not None:
+                        # Whole month is already stored, nothing to add
+                        if processed_df['ad_date'].max() <= latest_ad_str:
+                            continue
+                        # Only add records newer than the latest existing record
+                        processed_df = processed_df[processed_df['ad_date'] > latest_ad_str]
+                    
+                    new_frames.append(processed_df)
+                    print(f"✅ {year_month}: 新增 {len(processed_df)} 筆資料")
                 
             except Exception as e:
                 print(f"❌ 爬取 {year_month} 失敗: {e}")
-            
-            # Move to the next month
-            if current_month_iter.month == 12:
-                current_month_iter = current_month_iter.replace(year=current_month_iter.year + 1, month=1)
-            else:
-                current_month_iter = current_month_iter.replace(month=current_month_iter.month + 1)
         
-        if all_new_records:
-            new_df = pd.DataFrame(all_new_records)
-            
-            # Combine existing and new data, remove duplicates based on 'draw' and sort by 'ad_date'
-            combined_df = pd.concat([existing_df, new_df]).drop_duplicates(subset=['draw'])
-            
-            # CRITICAL FIX: Ensure 'ad_date' column is uniformly datetime before sorting
-            combined_df['ad_date'] = pd.to_datetime(combined_df['ad_date'])
+        new_count = sum(len(frame) for frame in new_frames)
+        
+        if new_count:
+            new_df = pd.concat(new_frames, ignore_index=True)
+            # Ensure 'ad_date' is uniformly datetime so both frames share one schema
+            new_df['ad_date'] = pd.to_datetime(new_df['ad_date'])
             
-            # Now sort
-            combined_df = combined_df.sort_values(by='ad_date').reset_index(drop=True)
+            # Combine existing and new data, remove duplicates based on 'draw' and sort by 'ad_date' in one lazy Polars plan
+            frames = [
+                pl.from_pandas(df).lazy().with_columns(pl.col('lottery_type').cast(pl.String))
+                for df in (existing_df, new_df) if not df.empty
+            ]
+            combined_df = (
+                pl.concat(frames, how='vertical_relaxed')
+                .unique(subset=['draw'], keep='first', maintain_order=True)
+                .sort('ad_date')
+                .collect()
+            )
             
-            # Save to CSV
-            combined_df.to_csv(filepath, index=False, encoding='utf-8')
+            # Save to Parquet
+            combined_df.write_parquet(filepath, compression='snappy')
             print(f"\n🎉 今彩539資料更新完成！")
             print(f"📈 本次新增 {new_count} 筆記錄，總計 {len(combined_df)} 筆")
             print(f"✅ 資料已儲存到: {filepath}")
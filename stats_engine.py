@@ -1,7 +1,67 @@
-import pandas as pd
+import numpy as np
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Dict, Any
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, List, Dict, Any, Mapping
 import os
+import tempfile
+import zipfile
+
+# pandas 只在讀取資料檔或存取完整資料表時才匯入；號碼矩陣快取有效時，統計流程完全不需要 pandas
+if TYPE_CHECKING:
+    import pandas as pd
+
+# SWAR (SIMD within a register) 常數：每期 5 個號碼補零成 8 bytes 後視為一個 uint64
+_LOW_BIT_OF_EACH_BYTE = np.uint64(0x0101010101010101)
+_HIGH_BIT_OF_EACH_BYTE = np.uint64(0x8080808080808080)
+_BIG_NUMBER_BIAS = np.uint64(0x6C6C6C6C6C6C6C6C) # 每個 byte 加 108：號碼 >= 20 時該 byte 最高位元為 1
+_BYTE_SUM_SHIFT = np.uint64(56)
+
+def _swar_odd_small_counts(nums: np.ndarray) -> tuple:
+    """
+    以 SWAR 位元運算一次算出每期的奇數個數與小號 (1-19) 個數。
+    每個 byte 的結果位元 (0 或 1) 乘上 0x0101...01 後，總和會累加到最高的 byte。
+    """
+    packed = np.zeros((len(nums), 8), dtype=np.uint8)
+    packed[:, :5] = nums
+    words = packed.view(np.uint64).ravel()
+
+    odd = ((words & _LOW_BIT_OF_EACH_BYTE) * _LOW_BIT_OF_EACH_BYTE) >> _BYTE_SUM_SHIFT
+    big_bits = ((words + _BIG_NUMBER_BIAS) & _HIGH_BIT_OF_EACH_BYTE) >> np.uint64(7)
+    big = (big_bits * _LOW_BIT_OF_EACH_BYTE) >> _BYTE_SUM_SHIFT
+    return odd.astype(np.int8), (5 - big.astype(np.int8)).astype(np.int8)
+
+def _freeze(value):
+    """
+    將統計結果轉為唯讀結構 (dict → MappingProxyType、list → tuple)，讓快取結果可安全共用。
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+def _thaw(value):
+    """
+    _freeze 的反向轉換，返回呼叫端可自由修改的 dict / list。
+    """
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+@dataclass(frozen=True)
+class AllStats:
+    """
+    calculate_all_stats 的結果，各欄位格式與對應的單項統計方法相同，但為唯讀結構 (dict → MappingProxyType、list → tuple)。
+    """
+    frequency: Mapping[int, int]
+    sum_analysis: Mapping[str, Any]
+    ratios: Mapping[str, Any]
+    consecutive: Mapping[str, Any]
+    last_digits: Mapping[int, int]
 
 class StatsEngine:
     """
@@ -9,68 +69,230 @@ class StatsEngine:
     負責從歷史開獎數據中提取各種統計資訊。
     """
 
-    def __init__(self, data_filepath: str = 'lottery_data/lottery_data.csv'):
+    # 奇數個數 / 大號個數只有 0-5 六種可能，分佈標籤預先建立，統計時依個數查表
+    _OE_LABEL = [f"{k}奇{5 - k}偶" for k in range(6)]
+    _BS_LABEL = [f"{k}大{5 - k}小" for k in range(6)]
+    # 每期的比例字串同樣查表而得，以 object 陣列一次取出 (奇偶比依奇數個數、大小比依小號個數)
+    _OE_RATIO = np.array([f"{k}:{5 - k}" for k in range(6)], dtype=object)
+    _BS_RATIO = np.array([f"{5 - k}:{k}" for k in range(6)], dtype=object)
+    # 連號組合 "低號,高號" 的標籤，依低號 (1-38) 查表
+    _PAIR_LABEL = [f"{low:02d},{low + 1:02d}" for low in range(39)]
+
+    def __init__(self, data_filepath: str = 'lottery_data/lottery_data.parquet', df: 'pd.DataFrame' = None):
+        """
+        若傳入已載入的 df，則直接使用而不再讀取 data_filepath。
+        否則優先由號碼矩陣快取 (依資料檔修改時間與大小判斷是否有效) 載入，完整資料表延後至首次存取時才讀取。
+        號碼矩陣、開獎日期與預先計算的特徵只在建構時設定一次，之後不再變動。
+        """
         self.data_filepath = data_filepath
-        self.df = self._load_data()
+        self.cache_filepath = os.path.splitext(data_filepath)[0] + '_stats_cache.npz'
+        self.nums = np.empty((0, 5), dtype=np.int8)
+        self.dates = np.empty(0, dtype='datetime64[D]')
+        self._df = None
+        self._signature = None
+        if df is not None:
+            self._df = self._build_arrays(df)
+        elif not self._load_cache():
+            # 讀檔前先取得簽章：讀檔期間資料檔若被改寫，快取的簽章與新檔案不符，下次即會失效
+            self._signature = self._data_signature()
+            self._df = self._build_arrays(self._read_data())
+            self._save_cache()
+        self._precompute_features()
 
-    def _load_data(self) -> pd.DataFrame:
+        # 各統計結果依 num_draws 以 LRU 快取；快取綁定於實例，資料更新後重新建立 StatsEngine 即失效
+        self._histograms = lru_cache(maxsize=16)(self._histograms)
+        self._frequency = self._memoized(self._frequency)
+        self._sum_analysis = self._memoized(self._sum_analysis)
+        self._ratios = self._memoized(self._ratios)
+        self._consecutive = self._memoized(self._consecutive)
+        self._last_digits = self._memoized(self._last_digits)
+
+    @staticmethod
+    def _memoized(method):
+        """
+        以 LRU 快取包裝單項統計的實作，依 num_draws 快取其唯讀結果。
         """
-        載入今彩539歷史數據，並進行初步處理。
+        @lru_cache(maxsize=16)
+        def cached(num_draws: int = None):
+            return _freeze(method(num_draws))
+        return cached
+
+    @property
+    def df(self) -> 'pd.DataFrame':
         """
+        完整的開獎資料表 (依日期排序)。由快取載入時，於首次存取才讀取資料檔。
+        此處只建立資料表，不會更動號碼矩陣與統計結果。
+        """
+        if self._df is None:
+            if not np.array_equal(self._data_signature(), self._signature):
+                print(f"警告：資料檔 {self.data_filepath} 在建立統計引擎後已變更，資料表可能與統計結果不一致，請重新建立 StatsEngine。")
+            self._df = self._sort_by_date(self._read_data())
+        return self._df
+
+    def _data_signature(self) -> np.ndarray:
+        """
+        資料檔的修改時間與大小，用來判斷號碼矩陣快取是否仍有效。資料檔不存在時返回 None。
+        """
+        if not os.path.exists(self.data_filepath):
+            return None
+        stat = os.stat(self.data_filepath)
+        return np.array([stat.st_mtime, stat.st_size], dtype=np.float64)
+
+    def _load_cache(self) -> bool:
+        """
+        資料檔未變更時，直接由快取載入號碼矩陣與開獎日期，略過讀檔與字串解析。
+        快取檔損毀或內容不完整時視為未命中，改由資料檔重建。
+        """
+        if not (os.path.exists(self.data_filepath) and os.path.exists(self.cache_filepath)):
+            return False
+        try:
+            with np.load(self.cache_filepath) as cache:
+                signature = cache['sig']
+                if not np.array_equal(signature, self._data_signature()):
+                    return False
+                nums = cache['nums']
+                dates = cache['dates']
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            print(f"讀取統計快取失敗: {e}")
+            return False
+        if nums.ndim != 2 or nums.shape[1] != 5 or len(nums) != len(dates):
+            print("讀取統計快取失敗: 快取內容不完整")
+            return False
+
+        self.nums, self.dates, self._signature = nums, dates, signature
+        return True
+
+    def _save_cache(self):
+        """
+        將解析後的號碼矩陣與開獎日期，連同讀檔前取得的簽章寫入快取。
+        先寫入同目錄的暫存檔再以 os.replace 取代，寫入中斷或多個程序同時寫入都不會留下損毀的快取檔。
+        """
+        if len(self.nums) == 0 or self._signature is None:
+            return
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(self.cache_filepath) or '.')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, nums=self.nums, dates=self.dates, sig=self._signature)
+            os.replace(tmp_path, self.cache_filepath)
+        except OSError as e:
+            print(f"寫入統計快取失敗: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _read_data(self) -> 'pd.DataFrame':
+        """
+        讀取今彩539歷史數據檔案。
+        """
+        import pandas as pd
+
         if not os.path.exists(self.data_filepath):
             print(f"錯誤：找不到資料檔案 {self.data_filepath}。請先執行資料爬取。")
             return pd.DataFrame()
 
-        df = pd.read_csv(self.data_filepath, dtype={'draw': str})
-        
-        # 將 'numbers' 字串轉換為整數列表
-        df['numbers_list'] = df['numbers'].apply(lambda x: [int(n) for n in x.split(',')])
-        
-        # 確保 'ad_date' 是 datetime 格式並排序
-        df['ad_date'] = pd.to_datetime(df['ad_date'])
-        df = df.sort_values(by='ad_date', ascending=True).reset_index(drop=True)
-        
+        return pd.read_parquet(self.data_filepath, engine='pyarrow', dtype_backend='pyarrow')
+
+    @staticmethod
+    def _sort_by_date(df: 'pd.DataFrame') -> 'pd.DataFrame':
+        """
+        將開獎數據依日期排序 (以 datetime64[D] 日期陣列穩定排序)。
+        """
+        import pandas as pd
+
+        if df.empty:
+            return df
+
+        # 確保 'ad_date' 是 datetime 格式
+        df = df.assign(ad_date=pd.to_datetime(df['ad_date']))
+        order = np.argsort(df['ad_date'].to_numpy(dtype='datetime64[D]'), kind='stable')
+        return df.iloc[order].reset_index(drop=True)
+
+    def _build_arrays(self, df: 'pd.DataFrame') -> 'pd.DataFrame':
+        """
+        將開獎數據依日期排序，並由排序後的資料表建立號碼矩陣與開獎日期陣列 (只在建構時呼叫)。
+        """
+        df = self._sort_by_date(df)
+        if df.empty:
+            return df
+
+        # 同時保存 (N, 5) 的 int8 號碼矩陣與開獎日期，統計與最新日期皆由這兩個陣列取得
+        self.nums = df['numbers'].str.split(',', n=4, expand=True).to_numpy(dtype=np.int8)
+        self.dates = df['ad_date'].to_numpy(dtype='datetime64[D]')
+
         return df
 
-    def get_latest_n_draws(self, n: int) -> pd.DataFrame:
+    def _precompute_features(self):
         """
-        獲取最新的 N 期開獎數據。
+        一次算出每期的和值、奇數個數、小號個數 (1-19) 與排序後號碼，
+        各統計方法只需切出最新 N 期，不必重複計算。
         """
-        if self.df.empty:
-            return pd.DataFrame()
-        return self.df.tail(n)
+        # 轉為 (5, N) 的逐欄連續排列後相加，每個號碼位置都以 stride-1 讀取，
+        # 比在 (N, 5) 上逐列做長度 5 的歸約快數倍
+        self._sums = np.ascontiguousarray(self.nums.T).sum(axis=0, dtype=np.int32)
+        self._odd, self._small = _swar_odd_small_counts(self.nums)
+        self._sorted = np.sort(self.nums, axis=1)
+
+    def get_latest_n_draws(self, n: int) -> 'pd.DataFrame':
+        """
+        獲取最新的 N 期開獎數據 (依日期遞增排序)，僅供顯示用途。
+        各統計方法直接以 _latest 切片號碼矩陣與預先計算的特徵，不經過此方法。
+        """
+        return self.df.iloc[max(len(self.df) - n, 0):]
+
+    def _latest(self, values: np.ndarray, num_draws: int = None) -> np.ndarray:
+        """
+        取得每期資料陣列 (號碼矩陣或預先計算的特徵) 的最新 N 期 (視圖，不複製資料)。
+        如果 num_draws 為 None，則返回所有期數。
+        """
+        if num_draws is None:
+            return values
+        return values[max(len(values) - num_draws, 0):]
+
+    def _histograms(self, num_draws: int = None) -> tuple:
+        """
+        掃描一次最新 N 期的號碼矩陣，同時返回號碼 (0-39) 與尾數 (0-9) 的出現次數。
+        尾數次數由號碼次數依尾數合併而得，不需再掃描一次號碼矩陣。結果依 num_draws 快取。
+        """
+        arr = self._latest(self.nums, num_draws)
+        freq_counts = np.bincount(arr.ravel(), minlength=40)
+        # 號碼 0-39 排成 4x10 後，同一欄即同一尾數，逐欄加總即為尾數次數 (整數運算，不經浮點權重)
+        last_digit_counts = freq_counts[:40].reshape(4, 10).sum(axis=0)
+        return freq_counts, last_digit_counts
 
     def calculate_frequency(self, num_draws: int = None) -> Dict[int, int]:
         """
         計算指定期數內每個號碼的出現頻率。
         如果 num_draws 為 None，則計算所有期數的頻率。
+        結果取自快取，返回可自由修改的副本。
         """
-        target_df = self.df
-        if num_draws is not None:
-            target_df = self.get_latest_n_draws(num_draws)
-        
-        if target_df.empty:
+        return _thaw(self._frequency(num_draws))
+
+    def _frequency(self, num_draws: int = None) -> Dict[int, int]:
+        """
+        calculate_frequency 的實作 (經 _memoized 快取)。
+        """
+        if len(self._latest(self.nums, num_draws)) == 0:
             return {}
 
-        all_numbers = [num for sublist in target_df['numbers_list'] for num in sublist]
-        frequency = pd.Series(all_numbers).value_counts().sort_index()
-        
         # 確保所有號碼 (1-39) 都在結果中，未出現的頻率為 0
-        full_range_freq = pd.Series(0, index=range(1, 40))
-        full_range_freq.update(frequency)
-        
-        return full_range_freq.to_dict()
+        counts, _ = self._histograms(num_draws)
+        return dict(zip(range(1, 40), counts[1:40].tolist()))
 
     def calculate_sum_analysis(self, num_draws: int = None) -> Dict[str, Any]:
         """
         計算指定期數內和值的統計分析。
         包括每期和值、平均和值、和值分佈。
+        結果取自快取，返回可自由修改的副本。
+        """
+        return _thaw(self._sum_analysis(num_draws))
+
+    def _sum_analysis(self, num_draws: int = None) -> Dict[str, Any]:
         """
-        target_df = self.df
-        if num_draws is not None:
-            target_df = self.get_latest_n_draws(num_draws)
+        calculate_sum_analysis 的實作 (經 _memoized 快取)。
+        """
+        sums = self._latest(self._sums, num_draws)
         
-        if target_df.empty:
+        if len(sums) == 0:
             return {
                 'sums': [],
                 'mean_sum': None,
@@ -80,27 +302,32 @@ class StatsEngine:
                 'max_sum': None
             }
 
-        sums = target_df['numbers_list'].apply(sum)
-        
+        # 直接在 int32 和值陣列上歸約，並轉為 Python float，結果不帶 NumPy 純量型別
         return {
             'sums': sums.tolist(),
-            'mean_sum': sums.mean(),
-            'median_sum': sums.median(),
-            'std_dev_sum': sums.std(),
-            'min_sum': sums.min(),
-            'max_sum': sums.max()
+            'mean_sum': float(sums.mean()),
+            'median_sum': float(np.median(sums)),
+            'std_dev_sum': float(sums.std(ddof=1)) if len(sums) > 1 else float('nan'), # 樣本標準差，與 pandas 相同
+            'min_sum': int(sums.min()),
+            'max_sum': int(sums.max())
         }
 
     def calculate_odd_even_big_small_ratios(self, num_draws: int = None) -> Dict[str, Any]:
         """
         計算指定期數內奇偶比和大小比的統計。
         大小號定義：1-19 為小，20-39 為大。
+        結果取自快取，返回可自由修改的副本。
+        """
+        return _thaw(self._ratios(num_draws))
+
+    def _ratios(self, num_draws: int = None) -> Dict[str, Any]:
+        """
+        calculate_odd_even_big_small_ratios 的實作 (經 _memoized 快取)。
         """
-        target_df = self.df
-        if num_draws is not None:
-            target_df = self.get_latest_n_draws(num_draws)
+        odd = self._latest(self._odd, num_draws)
+        small = self._latest(self._small, num_draws)
         
-        if target_df.empty:
+        if len(odd) == 0:
             return {
                 'odd_even_ratios': [],
                 'big_small_ratios': [],
@@ -108,97 +335,88 @@ class StatsEngine:
                 'big_small_counts': {}
             }
 
-        odd_even_ratios = []
-        big_small_ratios = []
-        odd_even_counts = {} # e.g., "3奇2偶": count
-        big_small_counts = {} # e.g., "3大2小": count
+        odd_counts = np.bincount(odd, minlength=6).tolist()
+        big_counts = np.bincount(small, minlength=6).tolist()[::-1] # 小號個數 k 即大號個數 5-k
 
-        for _, row in target_df.iterrows():
-            numbers = row['numbers_list']
-            
-            # 奇偶比
-            odd_count = sum(1 for n in numbers if n % 2 != 0)
-            even_count = 5 - odd_count
-            odd_even_ratios.append(f"{odd_count}:{even_count}")
-            odd_even_counts[f"{odd_count}奇{even_count}偶"] = odd_even_counts.get(f"{odd_count}奇{even_count}偶", 0) + 1
-
-            # 大小比 (1-19 小, 20-39 大)
-            small_count = sum(1 for n in numbers if 1 <= n <= 19)
-            big_count = 5 - small_count
-            big_small_ratios.append(f"{big_count}:{small_count}")
-            big_small_counts[f"{big_count}大{small_count}小"] = big_small_counts.get(f"{big_count}大{small_count}小", 0) + 1
-            
         return {
-            'odd_even_ratios': odd_even_ratios,
-            'big_small_ratios': big_small_ratios,
-            'odd_even_distribution': dict(sorted(odd_even_counts.items())),
-            'big_small_distribution': dict(sorted(big_small_counts.items()))
+            'odd_even_ratios': self._OE_RATIO.take(odd).tolist(),
+            'big_small_ratios': self._BS_RATIO.take(small).tolist(),
+            # e.g., "3奇2偶": count，依奇數個數遞增
+            'odd_even_distribution': {self._OE_LABEL[k]: odd_counts[k] for k in range(6) if odd_counts[k]},
+            # e.g., "3大2小": count，依大號個數遞增
+            'big_small_distribution': {self._BS_LABEL[k]: big_counts[k] for k in range(6) if big_counts[k]}
         }
 
     def analyze_consecutive_numbers(self, num_draws: int = None) -> Dict[str, Any]:
         """
         分析指定期數內的連號情況。
+        結果取自快取，返回可自由修改的副本。
+        """
+        return _thaw(self._consecutive(num_draws))
+
+    def _consecutive(self, num_draws: int = None) -> Dict[str, Any]:
         """
-        target_df = self.df
-        if num_draws is not None:
-            target_df = self.get_latest_n_draws(num_draws)
+        analyze_consecutive_numbers 的實作 (經 _memoized 快取)。
+        """
+        sorted_arr = self._latest(self._sorted, num_draws)
         
-        if target_df.empty:
+        if len(sorted_arr) == 0:
             return {'consecutive_patterns': {}, 'total_draws_with_consecutive': 0}
 
-        consecutive_patterns = {} # e.g., "12,13": count
-        total_draws_with_consecutive = 0
-
-        for _, row in target_df.iterrows():
-            numbers = sorted(row['numbers_list']) # 確保已排序
-            has_consecutive = False
-            for i in range(len(numbers) - 1):
-                if numbers[i+1] - numbers[i] == 1:
-                    pattern = f"{numbers[i]:02d},{numbers[i+1]:02d}"
-                    consecutive_patterns[pattern] = consecutive_patterns.get(pattern, 0) + 1
-                    has_consecutive = True
-            if has_consecutive:
-                total_draws_with_consecutive += 1
-                
+        # 每期號碼排序後，相鄰差為 1 即為連號
+        mask = np.diff(sorted_arr, axis=1) == 1
+        total_draws_with_consecutive = int(mask.any(axis=1).sum())
+
+        # 連號組合的高號必為低號 + 1，低號只有 1-38，以固定長度的直方圖統計即可
+        pair_counts = np.bincount(sorted_arr[:, :-1][mask], minlength=39).tolist()
+
         return {
-            'consecutive_patterns': dict(sorted(consecutive_patterns.items())),
+            'consecutive_patterns': {self._PAIR_LABEL[low]: count for low, count in enumerate(pair_counts) if count}, # e.g., "12,13": count
             'total_draws_with_consecutive': total_draws_with_consecutive,
-            'percentage_with_consecutive': (total_draws_with_consecutive / len(target_df)) * 100 if len(target_df) > 0 else 0
+            'percentage_with_consecutive': (total_draws_with_consecutive / len(sorted_arr)) * 100
         }
 
     def analyze_last_digits(self, num_draws: int = None) -> Dict[int, int]:
         """
         分析指定期數內每個尾數的出現頻率。
+        結果取自快取，返回可自由修改的副本。
         """
-        target_df = self.df
-        if num_draws is not None:
-            target_df = self.get_latest_n_draws(num_draws)
-        
-        if target_df.empty:
+        return _thaw(self._last_digits(num_draws))
+
+    def _last_digits(self, num_draws: int = None) -> Dict[int, int]:
+        """
+        analyze_last_digits 的實作 (經 _memoized 快取)。
+        """
+        if len(self._latest(self.nums, num_draws)) == 0:
             return {}
 
-        all_last_digits = []
-        for numbers in target_df['numbers_list']:
-            all_last_digits.extend([n % 10 for n in numbers])
-        
-        last_digit_frequency = pd.Series(all_last_digits).value_counts().sort_index()
-        
         # 確保所有尾數 (0-9) 都在結果中，未出現的頻率為 0
-        full_range_freq = pd.Series(0, index=range(0, 10))
-        full_range_freq.update(last_digit_frequency)
-        
-        return full_range_freq.to_dict()
+        _, counts = self._histograms(num_draws)
+        return dict(zip(range(10), counts.tolist()))
+
+    def calculate_all_stats(self, num_draws: int = None) -> AllStats:
+        """
+        一次取得頻率、和值、奇偶/大小比、連號與尾數統計。
+        各項直接共用單項統計的快取結果 (唯讀，不複製)，資料更新後請重新建立 StatsEngine。
+        """
+        return AllStats(
+            frequency=self._frequency(num_draws),
+            sum_analysis=self._sum_analysis(num_draws),
+            ratios=self._ratios(num_draws),
+            consecutive=self._consecutive(num_draws),
+            last_digits=self._last_digits(num_draws)
+        )
 
 # 範例使用
 if __name__ == "__main__":
-    # 確保 data_engine.py 已經執行並生成了 lottery_data/lottery_data.csv
+    # 確保 data_engine.py 已經執行並生成了 lottery_data/lottery_data.parquet
     # 如果沒有，請先執行 python data_engine.py
     
     stats_engine = StatsEngine()
 
-    if not stats_engine.df.empty:
+    if len(stats_engine.nums) > 0:
         print("--- 今彩539 統計分析報告 ---")
-        print(f"總計 {len(stats_engine.df)} 期資料。")
+        print(f"總計 {len(stats_engine.nums)} 期資料，資料截至 {stats_engine.dates[-1]}。")
 
         # 頻率分析
         print("\n--- 號碼頻率分析 (所有期數) ---")